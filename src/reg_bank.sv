@@ -22,12 +22,23 @@ module reg_bank #(
     output logic err,
     // registers
     output logic [NUM_CFG*REG_W-1:0] rw_regs,
-    input  logic [NUM_STATUS*REG_W-1:0] ro_regs
+    input  logic [NUM_STATUS*REG_W-1:0] ro_regs,
+    // interrupt request
+    output logic irq
 );
 
   // Limitations
   //  - NUM_CFG must be power of two
   //  - NUM_STATUS must be equal to NUM_CFG
+  //  - ADDR_W must be one bit wider than needed for NUM_CFG+NUM_STATUS, the MSB selects the interrupt registers
+
+  // Interrupt registers
+  localparam logic [ADDR_W-1:0] IRQ_ENABLE_ADDR  = {1'b1, {(ADDR_W-1){1'b0}}};
+  localparam logic [ADDR_W-1:0] IRQ_PENDING_ADDR = {1'b1, {(ADDR_W-2){1'b0}}, 1'b1};
+
+  // Interrupt sources (bit in enable and pending registers)
+  localparam int IRQ_WRITE  = 0; // config register written
+  localparam int IRQ_STATUS = 1; // read only registers changed
   
   // Iterator
   int i;
@@ -35,13 +46,33 @@ module reg_bank #(
   // rw registers
   logic [REG_W-1:0] config_regs [NUM_CFG-1:0];
   logic [REG_W-1:0] status_regs [NUM_STATUS-1:0];
+
+  // Interrupt registers
+  logic [REG_W-1:0] irq_enable;
+  logic [REG_W-1:0] irq_pending;
   
   // handshake
   assign ack = 1'b1;
   assign err = 1'b0;
 
-  // Mux to select config registers or read only registers access
-  assign rdata = (addr[ADDR_W-1] == 1'b0) ? config_regs[addr[ADDR_W-2:0]] : status_regs[addr[ADDR_W-2:0]];
+  // Address MSB selects the interrupt registers
+  logic irq_space;
+  assign irq_space = addr[ADDR_W-1];
+
+  // Mux to select config registers, read only registers or interrupt registers access
+  always_comb begin
+    if (addr == IRQ_ENABLE_ADDR) begin
+      rdata = irq_enable;
+    end else if (addr == IRQ_PENDING_ADDR) begin
+      rdata = irq_pending;
+    end else if (irq_space) begin
+      rdata = '0;
+    end else if (addr[ADDR_W-2] == 1'b0) begin
+      rdata = config_regs[addr[ADDR_W-3:0]];
+    end else begin
+      rdata = status_regs[addr[ADDR_W-3:0]];
+    end
+  end
 
   // Register write
   always_ff @(posedge clk or negedge rstb) begin
@@ -51,13 +82,75 @@ module reg_bank #(
       end
     end else begin
       if (ena) begin
-        if (we) begin
-          config_regs[addr[ADDR_W-2:0]] <= wdata;
+        if (we && !irq_space) begin
+          config_regs[addr[ADDR_W-3:0]] <= wdata;
+        end
+      end
+    end
+  end
+
+  // Previous value of the read only registers
+  // No reset: bits driven by constants are optimized away, status_valid masks the first compare
+  logic [NUM_STATUS*REG_W-1:0] ro_regs_q;
+  logic status_valid;
+
+  always_ff @(posedge clk) begin
+    if (ena) begin
+      ro_regs_q <= ro_regs;
+    end
+  end
+
+  always_ff @(posedge clk or negedge rstb) begin
+    if (!rstb) begin
+      status_valid <= 1'b0;
+    end else begin
+      if (ena) begin
+        status_valid <= 1'b1;
+      end
+    end
+  end
+
+  // Interrupt events
+  logic [REG_W-1:0] irq_events;
+
+  always_comb begin
+    irq_events = '0;
+    irq_events[IRQ_WRITE] = we & ~irq_space;
+    irq_events[IRQ_STATUS] = status_valid & (ro_regs != ro_regs_q);
+  end
+
+  // Interrupt enable (read/write) and pending (write 1 to clear) registers
+  // An event in the same cycle as the clear keeps its pending bit set
+  always_ff @(posedge clk or negedge rstb) begin
+    if (!rstb) begin
+      irq_enable <= '0;
+      irq_pending <= '0;
+    end else begin
+      if (ena) begin
+        if (we && (addr == IRQ_ENABLE_ADDR)) begin
+          irq_enable <= wdata;
+        end
+        if (we && (addr == IRQ_PENDING_ADDR)) begin
+          irq_pending <= (irq_pending & ~wdata) | irq_events;
+        end else begin
+          irq_pending <= irq_pending | irq_events;
         end
       end
     end
   end
 
+  // Interrupt request while any enabled event is pending
+  // Registered, so the output pin does not glitch while pending and enable settle
+  always_ff @(posedge clk or negedge rstb) begin
+    if (!rstb) begin
+      irq <= 1'b0;
+    end else begin
+      if (ena) begin
+        irq <= |(irq_pending & irq_enable);
+      end
+    end
+  end
+
   // Generate variable
   genvar x, y;
   // Convert to unpacked array
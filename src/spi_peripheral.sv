@@ -103,6 +103,11 @@ module spi_peripheral #(
     end
   end
 
+  // General counter
+  logic [3:0] buffer_counter;
+  // Counter value once a full byte has been sampled
+  localparam logic [3:0] BUFFER_FULL = REG_W[3:0];
+
   // Sample addr and data
   logic tx_buffer_load;
   logic sample_addr;
@@ -123,7 +128,7 @@ module spi_peripheral #(
         end
       end
       STATE_ADDR : begin
-        if (buffer_counter == REG_W) begin
+        if (buffer_counter == BUFFER_FULL) begin
           sample_addr = 1'b1;
           next_state = STATE_CMD;
         end else if (eof) begin
@@ -131,16 +136,16 @@ module spi_peripheral #(
         end
       end
       STATE_CMD : begin
-        if (reg_rw == 1'b0) begin
+        if (eof) begin
+          next_state = STATE_IDLE;
+        end else if (reg_rw == 1'b0) begin
           next_state = STATE_TX_DATA;
-        end else if (reg_rw) begin
+        end else begin
           next_state = STATE_RX_DATA;
-        end else if (eof) begin
-          next_state = STATE_IDLE;
         end
       end
       STATE_RX_DATA : begin
-        if (buffer_counter == REG_W) begin
+        if (buffer_counter == BUFFER_FULL) begin
           sample_data = 1'b1;
           next_state = STATE_IDLE;
         end else if (eof) begin
@@ -148,11 +153,12 @@ module spi_peripheral #(
         end
       end
       STATE_TX_DATA : begin
-        if (buffer_counter == '0) begin
-          tx_buffer_load = 1'b1;
-        end else if (buffer_counter == REG_W) begin
+        // Frame aborted before the data byte started must not hold the FSM in TX
+        if (eof) begin
           next_state = STATE_IDLE;
-        end else if (eof) begin
+        end else if (buffer_counter == '0) begin
+          tx_buffer_load = 1'b1;
+        end else if (buffer_counter == BUFFER_FULL) begin
           next_state = STATE_IDLE;
         end
       end
@@ -178,16 +184,14 @@ module spi_peripheral #(
     end
   end
 
-  // General counter
-  logic [3:0] buffer_counter;
-
   // Buffer Counter
   always_ff @(negedge(rstb) or posedge(clk)) begin
     if (!rstb) begin
       buffer_counter <= '0;
     end else begin
       if (ena) begin
-        if (buffer_counter == REG_W) begin
+        // Restart on end of frame, so an aborted frame does not shift the next one
+        if ((buffer_counter == BUFFER_FULL) || eof) begin
           buffer_counter <= '0;
         end else if (spi_data_sample) begin
           buffer_counter <= buffer_counter + 1'b1;
@@ -3,7 +3,7 @@
  * SPDX-License-Identifier: Apache-2.0
  */
 
-module top_wrapper #(parameter int NUM_CFG = 8, parameter int NUM_STATUS = 8, parameter int REG_WIDTH = 8) (rstb, clk, ena, mode, spi_cs_n, spi_clk, spi_mosi, spi_miso, i2c_sda_o, i2c_sda_oe, i2c_sda_i, i2c_scl, sel, rw_regs, ro_regs);
+module top_wrapper #(parameter int NUM_CFG = 8, parameter int NUM_STATUS = 8, parameter int REG_WIDTH = 8) (rstb, clk, ena, mode, spi_cs_n, spi_clk, spi_mosi, spi_miso, i2c_sda_o, i2c_sda_oe, i2c_sda_i, i2c_scl, sel, rw_regs, ro_regs, irq);
 
   input  logic rstb;
   input  logic clk;
@@ -24,6 +24,8 @@ module top_wrapper #(parameter int NUM_CFG = 8, parameter int NUM_STATUS = 8, pa
   // RW and RO registers
   output logic [NUM_CFG*REG_WIDTH-1:0] rw_regs;
   input  logic [NUM_STATUS*REG_WIDTH-1:0] ro_regs;
+  // Interrupt request
+  output logic irq;
 
   // Auxiliar variables for spi peripheral
   logic spi_wr_rdn;
@@ -47,7 +49,8 @@ module top_wrapper #(parameter int NUM_CFG = 8, parameter int NUM_STATUS = 8, pa
 
   // Auxiliar params
   localparam int NUM_REGS = NUM_CFG+NUM_STATUS;
-  localparam int ADDR_REG_BANK_W = $clog2(NUM_REGS);
+  // One more address bit for the interrupt registers
+  localparam int ADDR_REG_BANK_W = $clog2(NUM_REGS) + 1;
   logic [ADDR_REG_BANK_W-1:0] addr_reg_bank;
   
   // Tied extra bit off as SPI peripheral only provides 7 address bits
@@ -123,7 +126,8 @@ module top_wrapper #(parameter int NUM_CFG = 8, parameter int NUM_STATUS = 8, pa
     .ack(ack),
     .err(err),
     .rw_regs(rw_regs),
-    .ro_regs(ro_regs)
+    .ro_regs(ro_regs),
+    .irq(irq)
   );
 
   // Provide read data to both peripherals
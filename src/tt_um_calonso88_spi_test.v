@@ -41,12 +41,17 @@ module tt_um_calonso88_spi_test (
   wire spi_miso;
   wire spi_mosi;
 
+  // Status input and interrupt request
+  wire status_in;
+  wire irq;
+
   // Sync'ed
   wire cpol_sync;
   wire cpha_sync;
   wire spi_cs_n_sync;
   wire spi_clk_sync;
   wire spi_mosi_sync;
+  wire status_in_sync;
 
   // Peripheral selector
   // 1'b0 - SPI can access reg bank
@@ -76,9 +81,10 @@ module tt_um_calonso88_spi_test (
   assign uio_oe[1] = i2c_sda_oe;
   assign uio_oe[2] = 1'b0;
 
-  // Bi direction IOs [7] and [0] unused - set always as inputs
+  // Bi direction IOs [7] - status input, always input
+  // Bi direction IOs [0] - interrupt request, always output
   assign uio_oe[7] = 1'b0;
-  assign uio_oe[0] = 1'b0;
+  assign uio_oe[0] = 1'b1;
 
   // Bi-directional Input ports i2c
   assign i2c_sda_i = uio_in[1];
@@ -94,13 +100,18 @@ module tt_um_calonso88_spi_test (
   // Bi-directional Output ports SPI
   assign uio_out[3] = spi_miso;
 
+  // Bi-directional Input ports status
+  assign status_in = uio_in[7];
+
+  // Bi-directional Output ports interrupt
+  assign uio_out[0] = irq;
+
   // Bi-directional ouputs unused needs to be assigned to 0.
-  assign uio_out[0] = 1'b0;
   assign uio_out[2] = 1'b0;
   assign uio_out[7:4] = 4'b0000;
 
   // List all unused inputs to prevent warnings
-  wire _unused = &{ui_in[6:2], uio_in[7], uio_in[3], uio_in[0], rw_regs[NUM_CFG*REG_WIDTH-1:8], 1'b0};
+  wire _unused = &{ui_in[6:2], uio_in[3], uio_in[0], rw_regs[NUM_CFG*REG_WIDTH-1:8], 1'b0};
 
   // Number of stages in each synchronizer
   localparam int SYNC_STAGES = 2;
@@ -112,6 +123,7 @@ module tt_um_calonso88_spi_test (
   synchronizer #(.STAGES(SYNC_STAGES), .WIDTH(SYNC_WIDTH)) synchronizer_spi_cs_n_inst (.rstb(rst_n), .clk(clk), .ena(ena), .data_in(spi_cs_n), .data_out(spi_cs_n_sync));
   synchronizer #(.STAGES(SYNC_STAGES), .WIDTH(SYNC_WIDTH)) synchronizer_spi_clk_inst  (.rstb(rst_n), .clk(clk), .ena(ena), .data_in(spi_clk),  .data_out(spi_clk_sync));
   synchronizer #(.STAGES(SYNC_STAGES), .WIDTH(SYNC_WIDTH)) synchronizer_spi_mosi_inst (.rstb(rst_n), .clk(clk), .ena(ena), .data_in(spi_mosi), .data_out(spi_mosi_sync));
+  synchronizer #(.STAGES(SYNC_STAGES), .WIDTH(SYNC_WIDTH)) synchronizer_status_inst   (.rstb(rst_n), .clk(clk), .ena(ena), .data_in(status_in), .data_out(status_in_sync));
 
   // Assign status
   assign ro_regs[7:0]   = 8'hCA;
@@ -119,7 +131,7 @@ module tt_um_calonso88_spi_test (
   assign ro_regs[23:16] = 8'hAA;
   assign ro_regs[31:24] = 8'h55;
   assign ro_regs[39:32] = 8'hFF;
-  assign ro_regs[47:40] = 8'h00;
+  assign ro_regs[47:40] = {7'b0000000, status_in_sync};
   assign ro_regs[55:48] = 8'hA5;
   assign ro_regs[63:56] = 8'h5A;
   //assign ro_regs[NUM_STATUS*REG_WIDTH-1:64] = '0;
@@ -144,7 +156,8 @@ module tt_um_calonso88_spi_test (
     .i2c_scl(i2c_scl),
     .sel(sel),
     .rw_regs(rw_regs),
-    .ro_regs(ro_regs)
+    .ro_regs(ro_regs),
+    .irq(irq)
   );
 
 endmodule
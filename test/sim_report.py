@@ -0,0 +1,73 @@
+# SPDX-FileCopyrightText: © 2025 Caio Alonso da Costa
+# SPDX-License-Identifier: Apache-2.0
+
+# Compare wall-clock throughput of the same cocotb workload across simulators.
+# Usage: python sim_report.py results_icarus.xml results_verilator.xml ...
+# (written by "make compare", one results file per simulator)
+
+import os
+import sys
+import xml.etree.ElementTree as ET
+
+def load_results(path):
+  # Returns (seed, {test: (passed, sim_time_ns, real_time_s)})
+  root = ET.parse(path).getroot()
+  seed = None
+  for prop in root.iter("property"):
+    if (prop.get("name") == "random_seed"):
+      seed = prop.get("value")
+  tests = {}
+  for case in root.iter("testcase"):
+    passed = (case.find("failure") is None) and (case.find("error") is None)
+    tests[case.get("name")] = (passed, float(case.get("sim_time_ns", 0)), float(case.get("time", 0)))
+  return (seed, tests)
+
+def main(paths):
+  runs = {}
+  for path in paths:
+    sim = os.path.splitext(os.path.basename(path))[0].replace("results_", "")
+    if (not os.path.exists(path)):
+      print(f"{sim}: no results ({path} not found), skipped")
+      continue
+    runs[sim] = load_results(path)
+
+  if (not runs):
+    return 1
+
+  seeds = {seed for (seed, _) in runs.values()}
+  if (len(seeds) > 1):
+    print(f"WARNING: runs used different seeds {sorted(seeds)}, workloads are not the same")
+
+  sims = list(runs)
+  tests = []
+  for (_, results) in runs.values():
+    tests += [name for name in results if name not in tests]
+
+  # Throughput as simulated ns per wall-clock second, higher is better
+  print("| test | " + " | ".join(f"{sim} real (s) | {sim} sim ns/s" for sim in sims) + " |")
+  print("|---|" + "---|---|" * len(sims))
+  totals = {sim: [0.0, 0.0] for sim in sims}
+  for name in tests:
+    row = f"| {name} |"
+    for sim in sims:
+      result = runs[sim][1].get(name)
+      if (result is None):
+        row += " - | - |"
+        continue
+      (passed, sim_time, real_time) = result
+      totals[sim][0] += sim_time
+      totals[sim][1] += real_time
+      status = "" if passed else " FAIL"
+      row += f" {real_time:.2f}{status} | {sim_time / real_time:.3g} |"
+    print(row)
+  print("| total |" + "".join(f" {real:.2f} | {sim_time / real:.3g} |" for (sim_time, real) in totals.values()))
+
+  fastest = min(sims, key=lambda sim: totals[sim][1])
+  for sim in sims:
+    if (sim != fastest):
+      print(f"{fastest} is {totals[sim][1] / totals[fastest][1]:.1f}x faster than {sim}")
+
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main(sys.argv[1:]))
@@ -7,11 +7,14 @@
 module tb ();
 
   // Dump the signals to a VCD file. You can view it with gtkwave or surfer.
+  // NO_DUMP leaves it out (set by the Makefile for Verilator).
+`ifndef NO_DUMP
   initial begin
     $dumpfile("tb.vcd");
     $dumpvars(0, tb);
     #1;
   end
+`endif
 
   // Wire up the inputs and outputs:
   reg clk;
@@ -35,4 +38,12 @@ module tb ();
       .rst_n  (rst_n)     // not reset
   );
 
+  // SPI MISO and its output enable, used as event triggers by the SPI drivers
+  wire spi_miso    = uio_out[3];
+  wire spi_miso_oe = uio_oe[3];
+
+  // SPI clock and interrupt request, used to measure interrupt latency
+  wire spi_clk = uio_in[5];
+  wire irq     = uio_out[0];
+
 endmodule